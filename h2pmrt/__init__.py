@@ -1,3 +1,6 @@
+import collections.abc as cabc
+import concurrent.futures as cf
+import os
 import warnings
 
 import bs4
@@ -7,20 +10,29 @@ import h2pmrt.html as html
 import h2pmrt.text as text
 import h2pmrt.undo as undo
 
+try:
+    import html5_parser
+except (ImportError, RuntimeError):  # RuntimeError on libxml2 version mismatch
+    html5_parser = None
+
 warnings.filterwarnings("ignore", category=bs4.XMLParsedAsHTMLWarning)
 
 
+def _parse(html_string: str) -> bs4.BeautifulSoup:
+    """Parse html into a soup, using C-based html5-parser if available"""
+    if html5_parser:
+        return html5_parser.parse(html_string, treebuilder="soup", return_root=False)
+    return bs4.BeautifulSoup(html_string, "html5lib")
+
+
 def convert(html_string: str) -> str:
     """Convert html to poor man's rich text"""
-    soup = bs4.BeautifulSoup(text.cleanup(html_string), "html5lib")
+    soup = _parse(text.cleanup(html_string))
+    html.sanitize_tree(soup)
     undo.tue_phising_note(soup)
     html.mark_blocks(soup)
-    css.cssprops2htmlattrs(soup)
-    css.inline_style_blocks(soup)
-    css.add_defaults(soup)
-    css.css2html_markup(soup)
+    css.apply_all(soup)
     html.provide_alt_text(soup)
-    html.sanitize_tree(soup)
     html.br_type_original(soup)
     undo.link_rewriting(soup)
     html.direct_unwraps(soup)
@@ -42,3 +54,15 @@ def convert(html_string: str) -> str:
     html.replace_blockquotes(soup)
     html.brs2linebreaks(soup)
     return str(soup.string).strip()
+
+
+def convert_many(
+    html_strings: cabc.Iterable[str], workers: int | None = None
+) -> list[str]:
+    """Convert html strings to poor man's rich text in parallel, in input order"""
+    html_strings = list(html_strings)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunksize = max(1, len(html_strings) // (workers * 4))
+    with cf.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(convert, html_strings, chunksize=chunksize))
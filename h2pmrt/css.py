@@ -1,28 +1,40 @@
+import functools
+import re
+import sys
+
 import bs4
+import soupsieve as sv
 import tinycss2 as tc2
 
 
-def inline_style_blocks(soup: bs4.BeautifulSoup):
-    """Inline style blocks (ad hoc hacks, for now)"""
+# MS styles often encountered (hack until style blocks are inlined)
+MS_STYLES = frozenset(
+    {
+        "MsoNormal",
+        "MsoListParagraph",
+        "elementtoproof",
+        "x_MsoNormal",  # class renaming in some replies
+        "x_MsoListParagraph",
+    }
+)
+
+
+def inline_style_blocks(tag: bs4.Tag):
+    """Inline style blocks for a tag (ad hoc hacks, for now)"""
     # Option 1: use Python bindings of https://github.com/Stranger6667/css-inline
     # Option 2: inline styles myself using tinycss2 and bs4
 
-    # MS styles often encountered (hack until style blocks are inlined)
-    MS_STYLES = (
-        ".MsoNormal, .MsoListParagraph, .elementtoproof, "
-        ".x_MsoNormal, .x_MsoListParagraph"  # class renaming in some replies
-    )
-    for tag in soup.select(MS_STYLES):
-        if not tag.get("css-margin"):
-            if not tag.get("css-margin-top"):
-                tag["css-margin-top"] = "0"
-            if not tag.get("css-margin-bottom"):
-                tag["css-margin-bottom"] = "0"
+    if MS_STYLES.isdisjoint(tag.get_attribute_list("class")):
+        return
+    if not tag.get("css-margin"):
+        if not tag.get("css-margin-top"):
+            tag["css-margin-top"] = "0"
+        if not tag.get("css-margin-bottom"):
+            tag["css-margin-bottom"] = "0"
 
 
-def cssprops2htmlattrs(soup: bs4.BeautifulSoup):
-    """Convert CSS properties to HTML attributes"""
-    PROPERTIES_OF_INTEREST = {
+PROPERTIES_OF_INTEREST = frozenset(
+    {
         "border",
         "border-top",
         "border-bottom",
@@ -40,139 +52,278 @@ def cssprops2htmlattrs(soup: bs4.BeautifulSoup):
         "text-decoration",
         "list-style-type",
     }
-    UNINTERESTING_TOKENS = {
-        tc2.ast.WhitespaceToken,
-        tc2.ast.LiteralToken,
-        tc2.ast.FunctionBlock,
+)
+# Substrings of which at least one occurs in every property of interest
+PROPERTY_SUBSTRINGS = (
+    "border",
+    "margin",
+    "padding",
+    "font-",
+    "text-decoration",
+    "list-style-type",
+)
+CSS_ATTRS = {name: sys.intern("css-" + name) for name in PROPERTIES_OF_INTEREST}
+
+# Inline styles without escapes, functions, comments, or blocks can be split
+# into declarations and tokens with regular expressions
+re_simple_style = re.compile(
+    r"""(?:[\w \t\n\r\f.:;#%+,/-]|"[^"\\\n]*"|'[^'\\\n]*')*""", re.ASCII
+)
+re_style_part = re.compile(r"""((?:[^;"']|"[^"]*"|'[^']*')*)(?:;|$)""")
+re_declaration = re.compile(r"\s*([a-zA-Z-]+)\s*:(.*)", re.ASCII | re.DOTALL)
+re_value_token = re.compile(
+    r"(?P<ident>-?[a-zA-Z_][\w-]*)"
+    r"|#(?P<hash>[\w-]+)"
+    r"|(?P<number>[+-]?\d+(?:\.\d+)?)"
+    r"(?:(?P<percentage>%)|(?P<unit>(?![eE][+-]?\d)[a-zA-Z_][\w-]*))?",
+    re.ASCII,
+)
+
+
+# https://developer.mozilla.org/en-US/docs/Web/CSS/Reference/Values/length
+UNIT_SCALES = {  # unit: (multiplier, divisor) to get approximate line heights
+    "px": (1, 16),
+    "pt": (1, 12),
+    "pc": (1, 1),
+    "ch": (1, 2),
+    "ex": (1, 2),
+    "cap": (1, 1),
+    "em": (1, 1),
+    "ic": (1, 1),
+    "lh": (1, 1),
+    "rch": (1, 2),
+    "rex": (1, 2),
+    "rcap": (1, 1),
+    "rem": (1, 1),
+    "ric": (1, 1),
+    "rlh": (1, 1),
+    "in": (6, 1),
+    "cm": (6, 2.54),
+    "mm": (6, 25.4),
+    "Q": (6, 25.4 * 4),
+}
+
+
+def length2lines(value: float, unit: str) -> str | None:
+    """Express a length as approximate line heights, None for unknown units"""
+    if unit not in UNIT_SCALES:
+        return None
+    multiplier, divisor = UNIT_SCALES[unit]
+    return str(value * multiplier / divisor)
+
+
+def parse_style_simple(style: str) -> list[tuple[str, str]] | None:
+    """Parse simple inline style with regexes, None if too complex"""
+    if not re_simple_style.fullmatch(style):
+        return None
+    declarations = []
+    for part in re_style_part.findall(style):
+        decl = re_declaration.fullmatch(part)
+        if not decl or decl[1] not in PROPERTIES_OF_INTEREST:
+            continue  # invalid declarations are skipped by tinycss2 as well
+        values = []
+        for piece in decl[2].split():
+            token = re_value_token.fullmatch(piece)
+            if not token:
+                return None
+            if token["ident"]:
+                values.append(token["ident"])
+            elif token["hash"]:
+                values.append(token["hash"])
+            elif token["unit"]:
+                length = length2lines(float(token["number"]), token["unit"].lower())
+                if length is not None:
+                    values.append(length)
+            else:
+                values.append(str(float(token["number"])))
+        declarations.append((decl[1], " ".join(values)))
+    return declarations
+
+
+UNINTERESTING_TOKENS = (
+    tc2.ast.WhitespaceToken,
+    tc2.ast.LiteralToken,
+    tc2.ast.FunctionBlock,
+)
+
+
+def parse_style_tinycss2(style: str) -> list[tuple[str, str]]:
+    """Parse inline style with tinycss2"""
+    declarations = []
+    for decl in tc2.parse_blocks_contents(
+        style, skip_comments=True, skip_whitespace=True
+    ):
+        if decl.type == "declaration" and decl.name in PROPERTIES_OF_INTEREST:
+            values = []
+            for token in decl.value:
+                if isinstance(token, UNINTERESTING_TOKENS):
+                    continue
+                if token.type == "dimension":
+                    length = length2lines(token.value, token.lower_unit)
+                    if length is not None:
+                        values.append(length)
+                else:
+                    values.append(str(token.value))
+            declarations.append((decl.name, " ".join(values)))
+    return declarations
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_style(style: str) -> tuple[tuple[str, str], ...]:
+    """Parse inline style into (property, value) pairs, memoized per style"""
+    if "\\" not in style and not any(sub in style for sub in PROPERTY_SUBSTRINGS):
+        return ()  # no properties of interest (escapes could hide them)
+    declarations = parse_style_simple(style)
+    if declarations is None:
+        declarations = parse_style_tinycss2(style)
+    return tuple(declarations)
+
+
+def cssprops2htmlattrs(tag: bs4.Tag):
+    """Convert CSS properties of a tag to HTML attributes"""
+    if not tag.has_attr("style"):
+        return
+    for name, value in parse_style(str(tag["style"])):
+        tag[CSS_ATTRS[name]] = value
+    del tag["style"]
+
+
+NESTABLE_LISTS = frozenset({"ol", "ul"})  # ol ol, ol ul, ul ol, ul ul
+NONZERO_VERTICAL_MARGIN = frozenset(
+    {
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "p",
+        "blockquote",
+        "ul",
+        "ol",
+        "dl",
+        "dir",
+        "menu",
+        "fieldset",
+        "form",
     }
+)
 
-    for tag in soup.css.select("[style]"):
-        # Find rules applied
-        declarations = tc2.parse_blocks_contents(
-            tag["style"], skip_comments=True, skip_whitespace=True
-        )
-        for decl in declarations:
-            if decl.type == "declaration" and decl.name in PROPERTIES_OF_INTEREST:
-                values = []
-                for token in decl.value:
-                    if isinstance(token, tuple(UNINTERESTING_TOKENS)):
-                        continue
-                    if token.type == "dimension":
-                        # express all lengths as approximate line heights (https://developer.mozilla.org/en-US/docs/Web/CSS/Reference/Values/length)
-                        match token.lower_unit:
-                            case "px":
-                                values.append(str(token.value / 16))
-                            case "pt":
-                                values.append(str(token.value / 12))
-                            case "pc":
-                                values.append(str(token.value))
-                            case "ch" | "ex":
-                                values.append(str(token.value / 2))
-                            case "cap" | "em" | "ic" | "lh":
-                                values.append(str(token.value))
-                            case "rch" | "rex":
-                                values.append(str(token.value / 2))
-                            case "rcap" | "rem" | "ric" | "rlh":
-                                values.append(str(token.value))
-                            case "in":
-                                values.append(str(token.value * 6))
-                            case "cm":
-                                values.append(str(token.value * 6 / 2.54))
-                            case "mm":
-                                values.append(str(token.value * 6 / 25.4))
-                            case "Q":
-                                values.append(str(token.value * 6 / 25.4 / 4))
-                    else:
-                        values.append(str(token.value))
-                tag["css-" + decl.name] = " ".join(values)
-        del tag["style"]
-
-
-def add_defaults(soup: bs4.BeautifulSoup):
-    """Add some default styles that have a consequence in later processing"""
+
+def add_defaults(tag: bs4.Tag):
+    """Add some default styles to a tag that have a consequence in later processing"""
     # https://www.w3.org/TR/CSS2/sample.html
-    ZERO_VERTICAL_MARGIN = "ol ol, ol ul, ul ol, ul ul"
-    NONZERO_VERTICAL_MARGIN = (
-        "h1, h2, h3, h4, h5, h6, p, blockquote, ul, ol, dl, dir, menu, fieldset, form"
-    )
-    for tag in soup.select(ZERO_VERTICAL_MARGIN):
-        if not tag.get("css-margin"):
-            if not tag.get("css-margin-top"):
-                tag["css-margin-top"] = "0"
-            if not tag.get("css-margin-bottom"):
-                tag["css-margin-bottom"] = "0"
-    for tag in soup.select(NONZERO_VERTICAL_MARGIN):
-        if not tag.get("css-margin"):
-            if not tag.get("css-margin-top"):
-                tag["css-margin-top"] = "1"
-            if not tag.get("css-margin-bottom"):
-                tag["css-margin-bottom"] = "1"
-
-
-def css2html_markup(soup: bs4.BeautifulSoup):
-    """Convert CSS markup to HTML markup tags"""
-    CSS_MARKUP = {
-        "b": "[css-font-weight^=bold]:not(b, strong)",
-        "i": ",".join(
-            f"[css-font-style={style}]:not(i, em)" for style in {"italic", "oblique"}
-        ),
-        "u": "[css-text-decoration^=underline]:not(u, a)",
-    }
-    for markup_tag_name, selection in CSS_MARKUP.items():
-        for tag in soup.select(selection):
-            wrapper = soup.new_tag(markup_tag_name)
-            wrapper.extend(tag.contents)
-            tag.clear()
-            tag.append(wrapper)
+    if tag.get("css-margin"):
+        return
+    if tag.name in NESTABLE_LISTS and tag.find_parent(NESTABLE_LISTS):
+        margin = "0"
+    elif tag.name in NONZERO_VERTICAL_MARGIN:
+        margin = "1"
+    else:
+        return
+    if not tag.get("css-margin-top"):
+        tag["css-margin-top"] = margin
+    if not tag.get("css-margin-bottom"):
+        tag["css-margin-bottom"] = margin
+
+
+def wrap_contents(soup: bs4.BeautifulSoup, tag: bs4.Tag, name: str):
+    """Wrap the contents of a tag in a new tag with the given name"""
+    wrapper = soup.new_tag(name)
+    wrapper.extend(tag)
+    tag.append(wrapper)
+
+
+def css2html_markup(soup: bs4.BeautifulSoup, tag: bs4.Tag):
+    """Convert CSS markup of a tag to HTML markup tags"""
+    font_weight = str(tag.get("css-font-weight", ""))
+    font_style = tag.get("css-font-style")
+    text_decoration = str(tag.get("css-text-decoration", ""))
+    if tag.name not in {"b", "strong"} and font_weight.startswith("bold"):
+        wrap_contents(soup, tag, "b")
+    if tag.name not in {"i", "em"} and font_style in {"italic", "oblique"}:
+        wrap_contents(soup, tag, "i")
+    if tag.name not in {"u", "a"} and text_decoration.startswith("underline"):
+        wrap_contents(soup, tag, "u")
+
+
+def apply_all(soup: bs4.BeautifulSoup):
+    """Apply all CSS handling that only depends on the tag itself in one pass"""
+    for tag in soup.find_all(True):
+        cssprops2htmlattrs(tag)
+        inline_style_blocks(tag)
+        add_defaults(tag)
+        css2html_markup(soup, tag)
+
+
+def attr2tokens(tag: bs4.Tag, name: str) -> list[str]:
+    """Split an attribute value into whitespace-separated tokens"""
+    value = tag.get(name)
+    if isinstance(value, str):
+        return value.split()
+    return value or []
 
 
 def attr2float(attr):
     """Convert attribute to float, or None if not possible"""
     try:
-        float(str(attr))
+        return float(str(attr))
     except ValueError:
         return None
-    else:
-        return float(str(attr))
+
+
+BR_TYPES = {
+    (ws, position): sys.intern(f"{ws}-{position}")
+    for ws in ("margin", "padding")
+    for position in ("top", "bottom")
+}
 
 
 def cssws2br(ws, soup: bs4.BeautifulSoup):
     """Convert CSS margin and padding properties to br tags"""
     # Transform margin/padding to left, top, and bottom specializations
-    for tag in soup.select(f"[css-{ws}]"):
-        styles = str(tag[f"css-{ws}"]).split()
+    for tag in soup.find_all(attrs={f"css-{ws}": True}):
+        styles = attr2tokens(tag, f"css-{ws}")
         if not tag.get(f"css-{ws}-top"):
             tag[f"css-{ws}-top"] = styles[0]
         if not tag.get(f"css-{ws}-bottom"):
             tag[f"css-{ws}-bottom"] = styles[2 * (len(styles) > 2)]
     # Deal with top and bottom
-    for position in {"top", "bottom"}:
-        attr = f"css-{ws}-{position}"
-        # Move non-block margin/padding to parent block element
-        for tag in soup.select(f"[{attr}]:not([block])"):
-            parent = tag.parent
-            if parent.css.match("[block]"):
+    attrs = {position: f"css-{ws}-{position}" for position in ("top", "bottom")}
+    # Move non-block margin/padding to parent block element
+    for tag in soup.find_all(attrs={"block": None}):
+        parent = tag.parent
+        if not parent.has_attr("block"):
+            continue
+        for attr in attrs.values():
+            if tag.has_attr(attr):
                 if not parent.get(attr):
                     parent[attr] = tag[attr]
                 else:
                     parent[attr] = max(parent[attr], tag[attr])
-        # Insert br if margin/padding size is large enough
-        for tag in soup.select(f"[{attr}][block]"):
-            size = attr2float(tag[attr])
-            if size and size > 0.34:
-                br = soup.new_tag("br")
-                br["type"] = f"{ws}-{position}"
-                match position:
-                    case "top":
-                        tag.insert_before(br)
-                    case "bottom":
-                        tag.insert_after(br)
+    # Insert br if margin/padding size is large enough
+    insertions = []
+    for tag in soup.find_all(attrs={"block": True}):
+        for position, attr in attrs.items():
+            if tag.has_attr(attr):
+                size = attr2float(tag[attr])
+                if size and size > 0.34:
+                    br = soup.new_tag("br")
+                    br["type"] = BR_TYPES[ws, position]
+                    insertions.append((tag, position, br))
+    # Insert the br tags only after all lookups are done
+    for tag, position, br in insertions:
+        match position:
+            case "top":
+                tag.insert_before(br)
+            case "bottom":
+                tag.insert_after(br)
 
 
 def borderstyle2border(soup: bs4.BeautifulSoup):
     """Transform border-style to border/border-top/border-bottom"""
-    for tag in soup.select("[css-border-style]"):
-        styles = str(tag["css-border-style"]).split()
+    for tag in soup.find_all(attrs={"css-border-style": True}):
+        styles = attr2tokens(tag, "css-border-style")
         if len(styles) <= 2:
             tag["css-border"] = styles[0]
         else:
@@ -185,9 +336,8 @@ def borderstyle2border(soup: bs4.BeautifulSoup):
                 tag["css-border-bottom"] = bottom
 
 
-def border2tag(soup: bs4.BeautifulSoup):
-    """Convert CSS border properties to styled tags"""
-    STYLES = {
+BORDER_STYLES = frozenset(
+    {
         "dotted",
         "dashed",
         "solid",
@@ -197,30 +347,39 @@ def border2tag(soup: bs4.BeautifulSoup):
         "inset",
         "outset",
     }
-    CSS_BORDERS = {
-        property: ",".join(
-            f"[block][css-{property}*={style}]:not(hr)" for style in STYLES
-        )
-        for property in {"border", "border-top", "border-bottom"}
-    }
-    for property, selection in CSS_BORDERS.items():
-        for tag in soup.select(selection):
-            before = after = False
+)
+CSS_BORDERS = {
+    property: sv.compile(
+        ",".join(f"[block][css-{property}*={style}]:not(hr)" for style in BORDER_STYLES)
+    )
+    for property in ("border", "border-top", "border-bottom")
+}
+
+
+def border2tag(soup: bs4.BeautifulSoup):
+    """Convert CSS border properties to styled tags"""
+    insertions = []
+    for property, selector in CSS_BORDERS.items():
+        for tag in selector.select(soup):
             match property:
                 case "border":
-                    before = after = True
+                    positions = ("before", "after")
                 case "border-top":
-                    before = True
+                    positions = ("before",)
                 case "border-bottom":
-                    after = True
-            for position in {"before", "after"}:
+                    positions = ("after",)
+            for position in positions:
                 hr = soup.new_tag("hr")
                 hr["block"] = "inherent"
                 attr_name = "css-" + property
                 if property == "border":
                     attr_name += "-" + position
                 hr[attr_name] = tag[f"css-{property}"]
-                if before and position == "before":
-                    tag.insert_before(hr)
-                if after and position == "after":
-                    tag.insert_after(hr)
+                insertions.append((tag, position, hr))
+    # Insert the hr tags only after all lookups are done
+    for tag, position, hr in insertions:
+        match position:
+            case "before":
+                tag.insert_before(hr)
+            case "after":
+                tag.insert_after(hr)
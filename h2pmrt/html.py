@@ -1,13 +1,37 @@
+import collections
+import functools
 import os.path as op
 import re
 import urllib.parse as up
 
 import bs4
+import soupsieve as sv
+
+
+re_msoffice = re.compile(r"^o:")
+re_leading_spaces = re.compile(r"^ {2,}")
+re_trailing_spaces = re.compile(r" {2,}$")
+re_blank = re.compile(r"^[  \t]*$")
+
+
+def smooth(soup: bs4.BeautifulSoup):
+    """Merge adjacent strings like Tag.smooth, but without recursion"""
+    for tag in [soup, *soup.find_all(True)]:
+        # Merge from the end, so that earlier positions stay valid
+        for i in reversed(range(len(tag.contents) - 1)):
+            a, b = tag.contents[i], tag.contents[i + 1]
+            if (
+                isinstance(a, bs4.NavigableString)
+                and isinstance(b, bs4.NavigableString)
+                and not isinstance(a, bs4.element.PreformattedString)
+                and not isinstance(b, bs4.element.PreformattedString)
+            ):
+                b.extract()
+                a.replace_with(bs4.NavigableString(a + b))
 
 
-def mark_blocks(soup: bs4.BeautifulSoup):
-    """Mark tags that should be treated as block-type"""
-    BLOCKS = {
+BLOCKS = frozenset(
+    {
         "address",
         "article",
         "aside",
@@ -46,13 +70,48 @@ def mark_blocks(soup: bs4.BeautifulSoup):
         "ul",
         "video",
     }
-    for tag in soup.select(",".join(BLOCKS)):
-        tag["block"] = "inherent"
-    for tag in soup.select("*:has(br)"):
-        if tag.get("block"):
-            tag["block"] += " br-descendants"
-        else:
-            tag["block"] = "br-descendants"
+)
+
+
+def new_ancestors(
+    tag: bs4.Tag, soup: bs4.BeautifulSoup, seen: set[int]
+) -> list[bs4.Tag]:
+    """Add the ancestors of tag below soup to seen, returning the new ones
+
+    Ancestors are recorded in seen by id, as tags hash and compare by
+    content. The walk stops at the first ancestor seen before, as the
+    ancestors above it have been seen then too.
+    """
+    ancestors = []
+    for ancestor in tag.parents:
+        if ancestor is soup or id(ancestor) in seen:
+            break
+        seen.add(id(ancestor))
+        ancestors.append(ancestor)
+    return ancestors
+
+
+def mark_blocks(soup: bs4.BeautifulSoup):
+    """Mark tags that should be treated as block-type"""
+    marked = set()  # ids of tags already marked as having br descendants
+    # Document order visits ancestors before their descendants, so blocks
+    # are marked inherent before any of their br descendants is found
+    for tag in soup.find_all(True):
+        if tag.name in BLOCKS:
+            tag["block"] = "inherent"
+        elif tag.name == "br":
+            for ancestor in new_ancestors(tag, soup, marked):
+                if ancestor.get("block"):
+                    ancestor["block"] += " br-descendants"
+                else:
+                    ancestor["block"] = "br-descendants"
+
+
+@functools.lru_cache(maxsize=512)
+def src2alt(src: str) -> str:
+    """Derive alt text from an image source url, memoized per url"""
+    alt_text = up.unquote(op.basename(up.urlparse(src).path))
+    return alt_text.split(".")[0].replace("_", " ")
 
 
 def provide_alt_text(soup: bs4.BeautifulSoup):
@@ -61,69 +120,75 @@ def provide_alt_text(soup: bs4.BeautifulSoup):
         "Description automatically generated",
         "AI-generated content may be incorrect.",
     }
-    for img in soup.select("img"):
+    for img in soup("img"):
+        assert isinstance(img, bs4.Tag)
         img_ref = str(img.get("src", ""))
         alt_text = img.get("alt")
         if not alt_text or any(alt_text.endswith(string) for string in AUTOGEN):
-            alt_text = up.unquote(op.basename(up.urlparse(img_ref).path))
-            alt_text = alt_text.split(".")[0].replace("_", " ")
-            img["alt"] = alt_text
+            img["alt"] = src2alt(img_ref)
 
 
 def sanitize_tree(soup: bs4.BeautifulSoup):
     """Remove tags that can only get in the way"""
-    for tag in soup.select("head, style, meta, script"):
+    for tag in soup(["head", "style", "meta", "script"]):
+        assert isinstance(tag, bs4.Tag)
         tag.decompose()
-    for comment in soup(string=lambda elem: isinstance(elem, bs4.Comment)):
-        comment.decompose()
-    for doctype in soup(string=lambda elem: isinstance(elem, bs4.Doctype)):
-        doctype.decompose()
+    for string in soup(
+        string=lambda elem: isinstance(elem, (bs4.Comment, bs4.Doctype))
+    ):
+        string.decompose()
 
 
 def br_type_original(soup: bs4.BeautifulSoup):
     """Add ’original’ type to br tags in original html and strip whitespace"""
-    for br in soup.select("br"):
+    for br in soup("br"):
+        assert isinstance(br, bs4.Tag)
         br["type"] = "original"
         next = br.next
         if next and isinstance(next, bs4.NavigableString):
             next.replace_with(next.lstrip())
 
 
-def unwrap_spans(soup: bs4.BeautifulSoup):
-    """Unwrap all span-like tags"""
-    SPAN_LIKE = "span, font, center"
-    for tag in soup.select(SPAN_LIKE):
-        tag.unwrap()
-    # Now that span-likes are gone, we can deal with some special cases
-    LINK_UNDERLINING = "a > u, u:has(> a)"
-    for tag in soup.select(LINK_UNDERLINING):
-        tag.unwrap()
+SELECT_LINK_UNDERLINING = sv.compile("a > u, u:has(> a)")
 
 
-def unwrap_msoffice_tags(soup: bs4.BeautifulSoup):
-    """Unwrap all MS Office-specific tags"""
-    for tag in soup(re.compile("^o:")):
-        assert isinstance(tag, bs4.Tag)
+def unwrap_inline_wrappers(soup: bs4.BeautifulSoup):
+    """Unwrap all span-like and MS Office-specific tags"""
+    SPAN_LIKE = {"span", "font", "center"}
+    msoffice_tags = []
+    for tag in soup.find_all(True):
+        if tag.name in SPAN_LIKE:
+            tag.unwrap()
+        elif re_msoffice.match(tag.name):
+            msoffice_tags.append(tag)
+    # Now that span-likes are gone, we can deal with some special cases
+    for tag in SELECT_LINK_UNDERLINING.select(soup):
+        tag.unwrap()
+    # MS Office-specific tags are only unwrapped after the special cases
+    for tag in msoffice_tags:
         tag.unwrap()
 
 
 def unwrap_vertical_placement(soup: bs4.BeautifulSoup):
     """Unwrap all sub and sup tags"""
-    REPLACEABLE = "0123456789+-n"
-    SUB_REPLACEMENTS = "₀₁₂₃₄₅₆₇₈₉₊₋ₙ"
-    SUP_REPLACEMENTS = "⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻ⁿ"
+    SUB_REPLACEMENTS = dict(zip("0123456789+-n", "₀₁₂₃₄₅₆₇₈₉₊₋ₙ"))
+    SUP_REPLACEMENTS = dict(zip("0123456789+-n", "⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻ⁿ"))
     SUP_NO_CARET = {"st", "nd", "rd", "ste", "de", "e"}
-    for sub in soup.select("sub"):
-        if sub.string and len(sub.string) == 1 and sub.string in REPLACEABLE:
-            sub.replace_with(SUB_REPLACEMENTS[REPLACEABLE.find(sub.string)])
+    for sub in soup("sub"):
+        assert isinstance(sub, bs4.Tag)
+        string = sub.string
+        if string in SUB_REPLACEMENTS:
+            sub.replace_with(SUB_REPLACEMENTS[string])
         else:
             sub.insert(0, "_")
             sub.unwrap()
-    for sup in soup.select("sup"):
-        if sup.string and len(sup.string) == 1 and sup.string in REPLACEABLE:
-            sup.replace_with(SUP_REPLACEMENTS[REPLACEABLE.find(sup.string)])
-        elif sup.string in SUP_NO_CARET:
-            sup.replace_with(sup.string)
+    for sup in soup("sup"):
+        assert isinstance(sup, bs4.Tag)
+        string = sup.string
+        if string in SUP_REPLACEMENTS:
+            sup.replace_with(SUP_REPLACEMENTS[string])
+        elif string in SUP_NO_CARET:
+            sup.replace_with(string)
         else:
             sup.insert(0, "^")
             sup.unwrap()
@@ -131,71 +196,77 @@ def unwrap_vertical_placement(soup: bs4.BeautifulSoup):
 
 def direct_unwraps(soup: bs4.BeautifulSoup):
     """Unwrap some classes of tags directly"""
-    unwrap_spans(soup)
-    unwrap_msoffice_tags(soup)
+    unwrap_inline_wrappers(soup)
     unwrap_vertical_placement(soup)
-    soup.smooth()
+    smooth(soup)  # sweating relies on adjacent strings being merged
 
 
 def sweat_whitespace(soup: bs4.BeautifulSoup):
     """Iteratively move trimmable whitespace outside of tags"""
-    SWEATABLE = "a, b, strong, i, em, u, s"
+    SWEATABLE = {"a", "b", "strong", "i", "em", "u", "s"}
     SELECTION_TUPLES = [
         (
             0,
             lambda tag: tag.insert_before,
-            lambda string: string[: len(string) - len(string.lstrip())],
             str.lstrip,
+            lambda string, stripped: string[: len(string) - len(stripped)],
         ),
         (
             -1,
             lambda tag: tag.insert_after,
-            lambda string: string[len(string.rstrip()) :],
             str.rstrip,
+            lambda string, stripped: string[len(stripped) :],
         ),
     ]
-    sweating = True
-    while sweating:
-        sweating = False
-        for child_index, inserter, stripped, stripper in SELECTION_TUPLES:
-            for tag in soup.select(SWEATABLE):
-                children = list(tag.children)
-                if children != []:
-                    child = children[child_index]
+    # Reverse document order sweats nested tags before their ancestors
+    for tag in reversed(soup.find_all(SWEATABLE)):
+        sweating = True
+        while sweating:
+            sweating = False
+            for child_index, inserter, stripper, affix_of in SELECTION_TUPLES:
+                if tag.contents:
+                    child = tag.contents[child_index]
                     inserter_for_tag = inserter(tag)
                     match child.name:
                         case "br":
                             inserter_for_tag(child.extract())
                             sweating = True
                         case None:
-                            string = str(child)
-                            if string:
-                                affix = stripped(string)
-                                if affix:
-                                    inserter_for_tag(affix)
-                                    child.replace_with(stripper(string))
+                            if child:
+                                stripped = stripper(child)
+                                if len(stripped) < len(child):
+                                    inserter_for_tag(affix_of(child, stripped))
+                                    child.replace_with(stripped)
                                     sweating = True
                             else:
                                 child.decompose()
                                 sweating = True
-    soup.smooth()
+    smooth(soup)
 
 
 def trim_whitespace(soup: bs4.BeautifulSoup):
     """Trim accumulated whitespace from strings"""
-    for string in soup(string=re.compile(r"^ {2,}")):
-        string.replace_with(" " + string.lstrip(" "))
-    for string in soup(string=re.compile(r" {2,}$")):
-        string.replace_with(string.rstrip(" ") + " ")
+    for string in soup(string=True):
+        trimmed = string
+        if re_leading_spaces.search(trimmed):
+            trimmed = " " + trimmed.lstrip(" ")
+        if re_trailing_spaces.search(trimmed):
+            trimmed = trimmed.rstrip(" ") + " "
+        if trimmed is not string:
+            string.replace_with(trimmed)
 
 
 def sweat_markup(soup: bs4.BeautifulSoup):
     """Move single child markup outside of anchor tags"""
-    MARKUP = {"b", "strong", "i", "em", "u", "s"}
-    for markup_name in MARKUP:
-        for markup in soup.select(f"a > {markup_name}:only-child"):
-            markup.parent.wrap(soup.new_tag(markup_name))
-            markup.unwrap()
+    MARKUP = ("b", "strong", "i", "em", "u", "s")
+    for a in soup("a"):
+        assert isinstance(a, bs4.Tag)
+        # In this order, as moving markup out may expose other markup
+        for markup_name in MARKUP:
+            children = a(True, recursive=False)
+            if len(children) == 1 and children[0].name == markup_name:
+                a.wrap(soup.new_tag(markup_name))
+                children[0].unwrap()
 
 
 def sweat(soup: bs4.BeautifulSoup):
@@ -207,10 +278,24 @@ def sweat(soup: bs4.BeautifulSoup):
 
 def linebreak_blocks(soup: bs4.BeautifulSoup):
     """Add a linebreak between sibling block-like elements"""
-    for parent in soup.select("*:has([block])"):
-        for whitespace in parent(string=re.compile(r"^[  \t]*$"), recursive=False):
-            whitespace.decompose()
-        for block_sibling in parent.css.filter("[block]"):
+    tags = soup.find_all(True)
+    # Find the tags with block descendants by walking up from each block
+    with_blocks = set()  # ids of tags with block descendants
+    for tag in tags:
+        if tag.has_attr("block"):
+            new_ancestors(tag, soup, with_blocks)
+    for parent in tags:
+        if id(parent) not in with_blocks:
+            continue
+        # Remove whitespace between and collect block children in one go
+        block_siblings = []
+        for child in parent.contents[:]:
+            if isinstance(child, bs4.NavigableString):
+                if child and re_blank.search(child):
+                    child.decompose()
+            elif child.has_attr("block"):
+                block_siblings.append(child)
+        for block_sibling in block_siblings:
             previous = block_sibling.previous_sibling
             next = block_sibling.next_sibling
             if previous:
@@ -218,7 +303,7 @@ def linebreak_blocks(soup: bs4.BeautifulSoup):
                 br["type"] = "blocks"
                 block_sibling.insert_before(br)
             if next and (
-                isinstance(next, bs4.NavigableString) or not next.css.match("[block]")
+                isinstance(next, bs4.NavigableString) or not next.has_attr("block")
             ):
                 br = soup.new_tag("br")
                 br["type"] = "blocks"
@@ -226,57 +311,60 @@ def linebreak_blocks(soup: bs4.BeautifulSoup):
 
 
 def remove_empty(soup: bs4.BeautifulSoup):
-    """Iteratively remove empty tags"""
+    """Remove empty tags, including those emptied by removing their children"""
     VOIDS = {"br", "hr", "img", "col"}
-    maybe_some_empty_still = True
-    while maybe_some_empty_still:
-        maybe_some_empty_still = False
-        for tag in soup(lambda tag: tag.name not in VOIDS, string=None):
-            assert isinstance(tag, bs4.Tag)
-            if list(tag.children) in ([], [""]):
-                tag.decompose()
-                maybe_some_empty_still = True  # decompose may create empty tags
-        soup.smooth()
+    # Reverse document order visits descendants before their ancestors
+    for tag in reversed(soup.find_all(True)):
+        if tag.name in VOIDS:
+            continue
+        if all(
+            isinstance(child, bs4.NavigableString) and not child
+            for child in tag.children
+        ):
+            tag.decompose()
+    smooth(soup)
 
 
 def merge_markup(soup: bs4.BeautifulSoup):
     """Merge adjacent markup tags"""
-    EQUIVALENT = {"strong": "b", "em": "i"}
-    MERGEABLE = {"b", "i"}
-    soup.smooth()  # make sure there are no adjacent NavigableStrings
-    # Eliminate use of equivalent tag names for markup
-    for tag_name, equivalent_tag_name in EQUIVALENT.items():
-        for tag in soup.select(tag_name):
-            tag.name = equivalent_tag_name
-    for tag_name in MERGEABLE:
-        # Unwrap markup that is implied by ancestor markup
-        for tag in soup.select(tag_name + " " + tag_name):
-            tag.unwrap()
+    MERGEABLE = {"b": {"b", "strong"}, "i": {"i", "em"}}
+    smooth(soup)  # make sure there are no adjacent NavigableStrings
+    for tag_name, equivalent_tag_names in MERGEABLE.items():
+        # Unwrap markup that is implied by ancestor markup; ancestors come
+        # first in document order, so being inside markup can be propagated
+        outermost = []
+        inside = set()  # ids of markup tags and their descendants
+        for tag in soup.find_all(True):
+            if tag.name in equivalent_tag_names:
+                # Eliminate use of equivalent tag names for markup
+                tag.name = tag_name
+                if id(tag.parent) in inside:
+                    tag.unwrap()  # its children move to a parent inside
+                else:
+                    outermost.append(tag)  # never unwrapped, so stays in place
+                inside.add(id(tag))
+            elif id(tag.parent) in inside:
+                inside.add(id(tag))
         # Group by parent
-        sibling_map = dict()
-        for tag in soup.select(tag_name):
-            parent = tag.parent
-            if parent not in sibling_map:
-                sibling_map[parent] = [tag]
-            else:
-                sibling_map[parent].append(tag)
+        sibling_map = collections.defaultdict(list)
+        for tag in outermost:
+            sibling_map[id(tag.parent)].append(tag)
         # Go over all parents and discover mergeable tags
-        for parent, siblings in sibling_map.items():
+        for siblings in sibling_map.values():
+            if len(siblings) < 2:
+                continue
             siblings.reverse()  # to pop off left to right
             while len(siblings) >= 2:
                 tag = siblings.pop()
                 mergeable_tags = []
                 next_tag = tag.next_sibling
-                if (
-                    isinstance(next_tag, bs4.NavigableString)
-                    and str(next_tag).isspace()
-                ):
+                if isinstance(next_tag, bs4.NavigableString) and next_tag.isspace():
                     # deal with whitespace
                     ws_tag = next_tag
                     mergeable_tags.append(ws_tag)
                     next_tag = ws_tag.next_sibling
                     ws_tag.decompose()
-                if next_tag is not None and next_tag == siblings[-1]:
+                if next_tag is not None and next_tag is siblings[-1]:
                     assert isinstance(next_tag, bs4.Tag)
                     # we can merge something
                     mergeable_tags.extend(next_tag.contents)
@@ -284,12 +372,14 @@ def merge_markup(soup: bs4.BeautifulSoup):
                     next_tag.extract()
                     tag.extend(mergeable_tags)
                     siblings.append(tag)  # may be more to merge in later
-            parent.smooth()
+        # Merge strings split by unwrapping and merging (the rest still is)
+        smooth(soup)
 
 
 def replace_hrs(soup: bs4.BeautifulSoup):
     """Replace hr tags with box-building lines"""
-    for hr in soup.select("hr"):
+    for hr in soup("hr"):
+        assert isinstance(hr, bs4.Tag)
         if hr.get("css-border-before"):
             hr.replace_with("┌" + "─" * 39)
         elif hr.get("css-border-after"):
@@ -298,63 +388,70 @@ def replace_hrs(soup: bs4.BeautifulSoup):
             hr.replace_with("─" * 40)
 
 
+HEADING_SIGNPOSTS = {f"h{level}": "#" * level + " " for level in range(1, 7)}
+
+
 def replace_headings(soup: bs4.BeautifulSoup):
     """Replace headings with simpler markup"""
-    HEADINGS = "h1, h2, h3, h4, h5, h6"
-    for h in soup.select(HEADINGS):
-        level = int(h.name[1:])
+    for h in soup(list(HEADING_SIGNPOSTS)):
         b = h.wrap(soup.new_tag("b"))
         h.unwrap()
-        signpost = bs4.NavigableString("#" * level + " ")
+        signpost = bs4.NavigableString(HEADING_SIGNPOSTS[h.name])
         b.insert_before(signpost)
 
 
 def replace_anchors(soup: bs4.BeautifulSoup):
     """Replace anchors with coinciding text and href or empty"""
-    for a in soup.select("a"):
-        if not a.string:
+    for a in soup("a"):
+        assert isinstance(a, bs4.Tag)
+        string = a.string
+        if not string:
             continue
         href = str(a.get("href", ""))
         if href == "":
             a.unwrap()
             continue
-        text = str(a.string)
-        href_parts = href.rstrip("/").split(text.strip("</>"))
-        if len(href_parts) == 2:
-            head = href_parts[0]
-            tail = href_parts[-1]
-            match (head, tail):
-                case (
-                    ("", "")
-                    | ("mailto:", "")
-                    | ("tel:", "")
-                    | ("sms:", "")
-                    | ("sip:", "")
-                ):
+        text = str(string)
+        core = text.strip("</>")
+        if not core:
+            continue
+        # Only hrefs that end in the text matter, which then occurs once
+        head, found, tail = href.rstrip("/").partition(core)
+        if found and not tail:
+            match head:
+                case "" | "mailto:" | "tel:" | "sms:" | "sip:":
                     a.replace_with(text)
-                case ("http://", "") | ("http://", ""):
+                case "http://":
                     a.replace_with(href)
 
 
 def unwrap_table_cells(soup: bs4.BeautifulSoup):
     """Unwrap all th an td tags, separating with tabs"""
-    for parent in soup.select("*:has(> th, > td)"):
-        children = list(parent.children)
-        if len(children) > 1:
-            children = children[1:]
-            for child in children:
-                names = {child.name}
-                if child.previous:
-                    names.add(child.previous.name)
-                if len(names.difference({"br", "tr", "thead", "tfoot"})) == 2:
-                    child.insert_before("\t")
-    for cell in soup.select("th, td"):
+    NON_CELLS = {"br", "tr", "thead", "tfoot"}
+    cells = soup(["th", "td"])
+    # Deduplicate the parents
+    parents = {id(cell.parent): cell.parent for cell in cells}
+    for parent in parents.values():
+        # Slice (a copy, as tabs get inserted) past the first child
+        for child in parent.contents[1:]:
+            previous = child.previous
+            # Separate distinctly named neighbours that both are cell-like
+            if (
+                previous
+                and child.name not in NON_CELLS
+                and previous.name not in NON_CELLS
+                and child.name != previous.name
+            ):
+                child.insert_before("\t")
+    for cell in cells:
+        assert isinstance(cell, bs4.Tag)
         cell.unwrap()
 
 
 def replace_imgs(soup: bs4.BeautifulSoup):
     """Replace img tags with cid src by unlinked text representation"""
-    for img in soup.select("img"):
+    for img in soup("img"):
+        assert isinstance(img, bs4.Tag)
         src = str(img.get("src", ""))
         if src.startswith("cid:"):
             replacement = "{" + img["alt"] + "}"
@@ -381,15 +478,16 @@ def direct_replacements(soup: bs4.BeautifulSoup):
     replace_anchors(soup)
     unwrap_table_cells(soup)
     replace_imgs(soup)
-    soup.smooth()
 
 
 def ul_compilation(soup: bs4.BeautifulSoup):
     """Compile ul"""
     UL_SYMBOLS = {"disc": "•", "circle": "◦", "square": "▪"}
-    for menu in soup.select("menu"):
+    for menu in soup("menu"):
+        assert isinstance(menu, bs4.Tag)
         menu.name = "ul"
-    for ul in soup.select("ul"):
+    for ul in soup("ul"):
+        assert isinstance(ul, bs4.Tag)
         symbol_string = "disc"
         if ul.get("type"):
             symbol_string = str(ul["type"])
@@ -404,7 +502,53 @@ def ul_compilation(soup: bs4.BeautifulSoup):
             else:
                 symbol = symbol_string
             li.insert(0, symbol + " ")
-    soup.smooth()
+
+
+ROMAN_NUMERALS = (
+    (1000, "M"),
+    (900, "CM"),
+    (500, "D"),
+    (400, "CD"),
+    (100, "C"),
+    (90, "XC"),
+    (50, "L"),
+    (40, "XL"),
+    (10, "X"),
+    (9, "IX"),
+    (5, "V"),
+    (4, "IV"),
+    (1, "I"),
+)
+
+
+def roman_label(number: int) -> str:
+    """Upper-case roman numeral for a number from 1 to 3999"""
+    label = ""
+    for value, numeral in ROMAN_NUMERALS:
+        count, number = divmod(number, value)
+        label += numeral * count
+    return label
+
+
+def latin_label(number: int) -> str:
+    """Upper-case letter label for a positive number (A, …, Z, AA, AB, …)"""
+    label = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        label = chr(ord("A") + remainder) + label
+    return label
+
+
+def ol_label(number: int, lst: str) -> str:
+    """Label an ordered list item, in decimal where the style has no label"""
+    match lst:
+        case "lower-latin" | "upper-latin" if number > 0:
+            label = latin_label(number)
+        case "lower-roman" | "upper-roman" if 0 < number < 4000:
+            label = roman_label(number)
+        case _:
+            return str(number)
+    return label.lower() if lst.startswith("lower-") else label
 
 
 def ol_compilation(soup: bs4.BeautifulSoup):
@@ -416,74 +560,28 @@ def ol_compilation(soup: bs4.BeautifulSoup):
         "i": "lower-roman",
         "I": "upper-roman",
     }
-    LST2INSDICES = {
-        "decimal": [str(k) for k in range(1, 27)],
-        "lower-latin": "abcdefghijklmnopqrstuvw",
-        "upper-latin": "ABCDEFGHIJKLMNOPQRSTUVW",
-        "lower-roman": [
-            "i",
-            "ii",
-            "iii",
-            "iv",
-            "v",
-            "vi",
-            "vii",
-            "viii",
-            "ix",
-            "x",
-            "xi",
-            "xii",
-            "xiii",
-            "xiv",
-            "xv",
-            "xvi",
-            "xvii",
-            "xviii",
-            "xix",
-            "xx",
-        ],
-        "upper-roman": [
-            "I",
-            "II",
-            "III",
-            "IV",
-            "V",
-            "VI",
-            "VII",
-            "VIII",
-            "IX",
-            "X",
-            "XI",
-            "XII",
-            "XIII",
-            "XIV",
-            "XV",
-            "XVI",
-            "XVII",
-            "XVIII",
-            "XIX",
-            "XX",
-        ],
-    }
-    for ol in soup.select("ol"):
+    for ol in soup("ol"):
+        assert isinstance(ol, bs4.Tag)
         lst = TYPEATTR2LST[str(ol["type"])] if ol.get("type") else "decimal"
-        counter = (int(str(ol["start"])) if ol.get("start") else 1) - 1
+        counter = int(str(ol["start"])) if ol.get("start") else 1
         for li in ol("li", recursive=False):
             assert isinstance(li, bs4.Tag)
-            li_lst = LST2INSDICES[lst][counter] + ". "
             if li.get("css-list-style-type"):
                 li_lst = str(li["css-list-style-type"])
+            else:
+                li_lst = ol_label(counter, lst) + ". "
             li.insert(0, li_lst)
             counter += 1
-    soup.smooth()
 
 
 def list_compilations(soup: bs4.BeautifulSoup):
     """Compile lists"""
     ul_compilation(soup)
     ol_compilation(soup)
+    smooth(soup)  # so no empty string fragment hides what follows a br
     # Indent lists
-    for somel in soup.select("ul, ol"):
+    for somel in soup(["ul", "ol"]):
+        assert isinstance(somel, bs4.Tag)
         somel.insert(0, "\t")
         for br in somel("br"):
             if br.next:
@@ -493,22 +591,30 @@ def list_compilations(soup: bs4.BeautifulSoup):
 def markup2text(soup: bs4.BeautifulSoup):
     """Transform markup into text with delimiters"""
     MARKUP_MAP = {
-        "b, strong": "*",
-        "i, em": "/",
+        "b": "*",
+        "strong": "*",
+        "i": "/",
+        "em": "/",
         "u": "_",
         "s": "~",
     }
-    for selector, delimiter in MARKUP_MAP.items():
-        for tag in soup.select(selector):
-            children = list(tag.children)
-            if len(children) == 1 and children[0].name == "img":
-                # Do not add markup around img replacements
-                tag.unwrap()
-                continue
-            tag.insert(0, delimiter)
-            tag.append(delimiter)
-            tag.smooth()
+    # Handle one delimiter after the other, as inner img-only markup must be
+    # unwrapped before its enclosing markup is considered
+    DELIMITER_ORDER = {"*": 0, "/": 1, "_": 2, "~": 3}
+    tags = sorted(
+        soup(list(MARKUP_MAP)),
+        key=lambda tag: DELIMITER_ORDER[MARKUP_MAP[tag.name]],
+    )
+    for tag in tags:
+        delimiter = MARKUP_MAP[tag.name]
+        children = tag.contents
+        if len(children) == 1 and children[0].name == "img":
+            # Do not add markup around img replacements
             tag.unwrap()
+            continue
+        tag.insert(0, delimiter)
+        tag.append(delimiter)
+        tag.unwrap()
 
 
 def tags2text(soup: bs4.BeautifulSoup):
@@ -519,31 +625,19 @@ def tags2text(soup: bs4.BeautifulSoup):
     link_map: dict[(str, bool), int] = dict()
 
     def process_tag(tag: bs4.Tag):
-        """Recursively replace composite tags by poor man's rich texts"""
-        # print(f".{tag.name.upper()}", end="")
-        children = list(tag.children)
-        # Recurse
-        if len(children) > 0:
-            # print(len(children), end="")
-            for child in children:
-                if isinstance(child, bs4.Tag):
-                    process_tag(child)
-                else:
-                    pass
-                    # print("_", end="")
-            # Merge strings
-            tag.smooth()
+        """Replace a composite tag by poor man's rich text"""
         # Create link blocks
         nonlocal link_counter
         nonlocal link_block_tag
+        name = tag.name
         # Anchors
-        if tag.name == "a":
+        if name == "a":
             href = str(tag.get("href", ""))
             title = tag.get("title")
             if not title or title == href:
                 ref = href
             else:
-                ref = href + f" ({title})"
+                ref = f"{href} ({title})"
             if (ref, "a") not in link_map:
                 candidate = tag
                 if not link_block_tag:
@@ -564,7 +658,7 @@ def tags2text(soup: bs4.BeautifulSoup):
             tag.unwrap()
             return
         # Images
-        if tag.name == "img":
+        if name == "img":
             ref = str(tag.get("src", ""))
             if (ref, "img") not in link_map:
                 candidate = tag
@@ -581,103 +675,137 @@ def tags2text(soup: bs4.BeautifulSoup):
                             candidate = candidate.parent
                 link_map[(ref, "img")] = link_counter
                 link_counter += 1
-            tag.replace_with(
-                "{" + tag["alt"] + "}{" + str(link_map[(ref, "img")]) + "}"
-            )
+            tag.replace_with(f"{{{tag['alt']}}}{{{link_map[(ref, 'img')]}}}")
             return
         # link blocks
         if tag is link_block_tag:
             br = soup.new_tag("br")
             br["type"] = "linkblock-pre"
             tag.append(br)
-            for (ref, tag_name), k in sorted(
-                link_map.items(), key=lambda pair: pair[1]
-            ):
+            # Insertion order is numbering order, as the counter only grows
+            for (ref, tag_name), k in link_map.items():
                 br = soup.new_tag("br")
                 br["type"] = "linkref"
                 tag.append(br)
                 match tag_name:
                     case "a":
-                        tag.append("\t[" + str(k) + "]: " + ref)
+                        tag.append(f"\t[{k}]: {ref}")
                     case "img":
-                        tag.append("\t{" + str(k) + "}: " + ref)
+                        tag.append(f"\t{{{k}}}: {ref}")
             br = soup.new_tag("br")
             br["type"] = "linkblock-post"
             tag.append(br)
             link_map.clear()
             link_block_tag = None
 
-    process_tag(soup)
+    # Process children before their parent, using an explicit stack instead
+    # of recursion (smooth below does not recurse either), so that deeply
+    # nested documents do not hit the recursion limit; children are listed
+    # upon visiting, as they may unwrap themselves
+    stack: list[tuple[bs4.Tag, bool]] = [(soup, False)]
+    while stack:
+        tag, visited = stack.pop()
+        if visited:
+            process_tag(tag)
+        else:
+            stack.append((tag, True))
+            stack.extend(
+                (child, False)
+                for child in reversed(tag.contents)
+                if isinstance(child, bs4.Tag)
+            )
+    smooth(soup)  # merge strings once, as nothing above depends on merging
+
+
+SELECT_UNWRAPPABLE = sv.compile("*:not(br, blockquote)")
 
 
 def unwrap_remaining(soup: bs4.BeautifulSoup):
     """Unwrap all non-br and non-blockquote tags"""
-    for tag in soup.select("*:not(br, blockquote)"):
+    for tag in SELECT_UNWRAPPABLE.select(soup):
         tag.unwrap()
 
 
+BR_CULLING_MAP = {
+    # no substitutions
+    ("margin-bottom", "margin-bottom", "any"): "keep",
+    ("margin-bottom", "padding-bottom", "any"): "keep",
+    ("margin-top", "margin-top", "any"): "keep",
+    ("margin-top", "padding-top", "any"): "keep",
+    ("padding-bottom", "padding-bottom", "any"): "keep",
+    ("padding-bottom", "linkblock-pre", "linkref"): "keep",
+    ("any", "linkblock-pre", "linkref"): "keep",
+    ("padding-top", "padding-top", "any"): "keep",
+    ("blocks", "any", "blocks"): "keep",
+    ("blocks", "margin-bottom", "margin-top"): "keep",
+    ("blocks", "padding-bottom", "padding-top"): "keep",
+    ("margin-top", "margin-bottom", "margin-top"): "keep",
+    ("padding-top", "padding-bottom", "any"): "keep",
+    ("blocks", "original", "any"): "keep",
+    ("blocks", "margin-bottom", "linkblock-pre"): "keep",
+    ("blocks", "margin-bottom", "original"): "keep",
+    (  # TODO: werkt niet? zie nieuwsbrief
+        "padding-bottom",
+        "original",
+        "original",
+    ): "keep",
+    # br["type"] = prev["type"]
+    (  # TODO: werkt niet? zie teams_meeting_quoted
+        "original",
+        "any",
+        "original",
+    ): "prev_to_br",
+    ("margin-bottom", "blocks", "margin-top"): "prev_to_br",
+    ("padding-bottom", "blocks", "padding-top"): "prev_to_br",
+    ("padding-bottom", "margin-bottom", "any"): "prev_to_br",
+    ("padding-bottom", "padding-top", "original"): "prev_to_br",
+    ("original", "padding-bottom", "padding-top"): "prev_to_br",
+    ("any", "blocks", "blocks"): "prev_to_br",
+    ("original", "original", "blocks"): "prev_to_br",
+    ("padding-top", "margin-top", "any"): "prev_to_br",
+    (  # TODO: werkt niet? zie nieuwsbrief
+        "original",
+        "original",
+        "padding-bottom",
+    ): "prev_to_br",
+    # next["type"] = br["type"], br["type"] = prev["type"]
+    ("margin-bottom", "margin-top", "blocks"): "shift_forward",
+    ("padding-bottom", "padding-top", "blocks"): "shift_forward",
+    ("original", "margin-top", "blocks"): "shift_forward",
+    ("padding-top", "original", "blocks"): "shift_forward",
+    ("linkblock-post", "margin-bottom", "blocks"): "shift_forward",
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def br_culling_action(
+    prev_type: str, br_type: str, next_type: str | None
+) -> str | None:
+    """Return the action of the first culling pattern matching the br types"""
+    for (prev_tg, br_tg, next_tg), action in BR_CULLING_MAP.items():
+        if (
+            prev_tg in {"any", prev_type}
+            and br_tg in {"any", br_type}
+            and next_tg in {"any", next_type}
+        ):
+            return action
+    return None
+
+
 def cull_brs(soup: bs4.BeautifulSoup):
     """Cull br tags and interspersed whitespace considered superfluous"""
     # Decompose whitespace between br tags
-    for ws in soup(string=re.compile(r"^[  \t]*$")):
+    for ws in soup(string=re_blank):
         prev = ws.previous_sibling
         next = ws.next_sibling
-        if prev and next and {prev.name, next.name} == {"br"}:
+        if prev and next and prev.name == "br" and next.name == "br":
             ws.decompose()
     # Decompose some br tags considered superfluous
-    BR_CULLING_MAP = {
-        # no substitutions
-        ("margin-bottom", "margin-bottom", "any"): "keep",
-        ("margin-bottom", "padding-bottom", "any"): "keep",
-        ("margin-top", "margin-top", "any"): "keep",
-        ("margin-top", "padding-top", "any"): "keep",
-        ("padding-bottom", "padding-bottom", "any"): "keep",
-        ("padding-bottom", "linkblock-pre", "linkref"): "keep",
-        ("any", "linkblock-pre", "linkref"): "keep",
-        ("padding-top", "padding-top", "any"): "keep",
-        ("blocks", "any", "blocks"): "keep",
-        ("blocks", "margin-bottom", "margin-top"): "keep",
-        ("blocks", "padding-bottom", "padding-top"): "keep",
-        ("margin-top", "margin-bottom", "margin-top"): "keep",
-        ("padding-top", "padding-bottom", "any"): "keep",
-        ("blocks", "original", "any"): "keep",
-        ("blocks", "margin-bottom", "linkblock-pre"): "keep",
-        ("blocks", "margin-bottom", "original"): "keep",
-        (  # TODO: werkt niet? zie nieuwsbrief
-            "padding-bottom",
-            "original",
-            "original",
-        ): "keep",
-        # br["type"] = prev["type"]
-        (  # TODO: werkt niet? zie teams_meeting_quoted
-            "original",
-            "any",
-            "original",
-        ): "prev_to_br",
-        ("margin-bottom", "blocks", "margin-top"): "prev_to_br",
-        ("padding-bottom", "blocks", "padding-top"): "prev_to_br",
-        ("padding-bottom", "margin-bottom", "any"): "prev_to_br",
-        ("padding-bottom", "padding-top", "original"): "prev_to_br",
-        ("original", "padding-bottom", "padding-top"): "prev_to_br",
-        ("any", "blocks", "blocks"): "prev_to_br",
-        ("original", "original", "blocks"): "prev_to_br",
-        ("padding-top", "margin-top", "any"): "prev_to_br",
-        (  # TODO: werkt niet? zie nieuwsbrief
-            "original",
-            "original",
-            "padding-bottom",
-        ): "prev_to_br",
-        # next["type"] = br["type"], br["type"] = prev["type"]
-        ("margin-bottom", "margin-top", "blocks"): "shift_forward",
-        ("padding-bottom", "padding-top", "blocks"): "shift_forward",
-        ("original", "margin-top", "blocks"): "shift_forward",
-        ("padding-top", "original", "blocks"): "shift_forward",
-        ("linkblock-post", "margin-bottom", "blocks"): "shift_forward",
-    }
     maybe_superfluous = True
     while maybe_superfluous:
         maybe_superfluous = False
-        for br in soup.select("br"):
+        for br in soup("br"):
+            assert isinstance(br, bs4.Tag)
             br_type = br["type"]
             prev = br.previous_sibling
             if not (prev and prev.name == "br"):
@@ -685,35 +813,34 @@ def cull_brs(soup: bs4.BeautifulSoup):
             prev_type = prev["type"]
             next = br.next_sibling
             next_type = next["type"] if next and next.name == "br" else None
-            for (prev_tg, br_tg, next_tg), action in BR_CULLING_MAP.items():
-                if (
-                    prev_tg in {"any", prev_type}
-                    and br_tg in {"any", br_type}
-                    and next_tg in {"any", next_type}
-                ):
-                    prev.decompose()  # always prev to not break br-iteration
-                    maybe_superfluous = True
-                    match action:
-                        case "prev_to_br":
-                            br["type"] = prev_type
-                        case "shift_forward":
-                            next["type"] = br_type
-                            br["type"] = prev_type
-                    break
+            action = br_culling_action(prev_type, br_type, next_type)
+            if action is None:
+                continue
+            prev.decompose()  # always prev to not break br-iteration
+            maybe_superfluous = True
+            match action:
+                case "prev_to_br":
+                    br["type"] = prev_type
+                case "shift_forward":
+                    next["type"] = br_type
+                    br["type"] = prev_type
 
 
 def replace_blockquotes(soup: bs4.BeautifulSoup):
     """Replace blockquotes by preceding lines with poor man's quote chars"""
-    for blockquote in soup.select("blockquote"):
+    for blockquote in soup("blockquote"):
+        assert isinstance(blockquote, bs4.Tag)
         blockquote.insert(0, "> ")
-        for br in blockquote.select("br"):
+        for br in blockquote("br"):
+            assert isinstance(br, bs4.Tag)
             br.insert_after("> ")
         blockquote.unwrap()
 
 
 def brs2linebreaks(soup: bs4.BeautifulSoup):
     """Replace br tags with linebreaks"""
-    for br in soup.select("br"):
+    for br in soup("br"):
+        assert isinstance(br, bs4.Tag)
         # br.replace_with(f"\n[{br.get('type')}]")
         br.replace_with("\n")
-    soup.smooth()
+    smooth(soup)
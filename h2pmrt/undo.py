@@ -3,7 +3,8 @@ import bs4
 
 def ms_sender_identification(soup: bs4.BeautifulSoup):
     """Remove MS SenderIdentification string(s)"""
-    for a in soup.select("a[href='https://aka.ms/LearnAboutSenderIdentification']"):
+    for a in soup("a", href="https://aka.ms/LearnAboutSenderIdentification"):
+        assert isinstance(a, bs4.Tag)
         # find first br before (or first sibling) and after (or last sibling)
         before = a
         while not (before and before.name == "br"):
@@ -26,20 +27,19 @@ def ms_sender_identification(soup: bs4.BeautifulSoup):
             case (_, _):
                 a.parent.decompose()
                 return
-        completed = False
-        while not completed:
-            if tag is after:
-                completed = True
+        doomed = [tag]
+        while tag is not after:
             tag = tag.next_sibling
-            tag.previous_sibling.decompose()
+            doomed.append(tag)
+        for tag in doomed:
+            tag.decompose()
 
 
 def link_rewriting(soup: bs4.BeautifulSoup):
     # MS safelinks
     for a in soup("a", originalsrc=True):
         assert isinstance(a, bs4.Tag)
-        a["href"] = a["originalsrc"]
-        del a["originalsrc"]
+        a["href"] = a.attrs.pop("originalsrc")
 
 
 def tue_phising_note(soup: bs4.BeautifulSoup):
@@ -49,5 +49,5 @@ def tue_phising_note(soup: bs4.BeautifulSoup):
         "padding:12.0pt 12.0pt 12.0pt 12.0pt; "
         "background:lightyellow"
     )
-    for div in soup.select(f"div[style='{STYLE}']"):
+    for div in soup("div", style=STYLE):
         div.decompose()
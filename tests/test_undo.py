@@ -0,0 +1,35 @@
+import bs4
+
+from h2pmrt import undo
+
+
+SENDER_ID = (
+    "You don't often get email from x. "
+    "<a href='https://aka.ms/LearnAboutSenderIdentification'>Learn why</a>"
+)
+
+
+def _undone(html_string: str) -> str:
+    soup = bs4.BeautifulSoup(html_string, "html5lib")
+    undo.ms_sender_identification(soup)
+    return str(soup.body)
+
+
+def test_sender_identification_between_brs():
+    body = _undone(f"<p>Hi<br>{SENDER_ID}<br>There</p>")
+    assert body == "<body><p>Hi<br/>There</p></body>"
+
+
+def test_sender_identification_after_br():
+    body = _undone(f"<p>Hi<br>{SENDER_ID}</p><p>Body</p>")
+    assert body == "<body><p>Hi</p><p>Body</p></body>"
+
+
+def test_sender_identification_before_br():
+    body = _undone(f"<p>{SENDER_ID}<br>Hi</p><p>Body</p>")
+    assert body == "<body><p>Hi</p><p>Body</p></body>"
+
+
+def test_sender_identification_without_brs():
+    body = _undone(f"<p>{SENDER_ID}</p><p>Body</p>")
+    assert body == "<body><p>Body</p></body>"